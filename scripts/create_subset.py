@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Build the small GTF/BED subset used by the integration tests from the full benchmark data."""
+
+import io
+import mmap
+import multiprocessing
+import operator
+import os
+import sys
+from collections import Counter, defaultdict
+
+# Paths
+DATA_DIR = os.path.join(os.path.dirname(__file__), "../tests/data")
+GTF_INPUT = os.path.join(DATA_DIR, "full_genome.gtf")
+BED_INPUT = os.path.join(DATA_DIR, "full_peaks.bed")
+GTF_OUTPUT = os.path.join(DATA_DIR, "subset_genome.gtf")
+BED_OUTPUT = os.path.join(DATA_DIR, "subset_peaks.bed")
+
+CHROMOSOMES = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY"]
+CHROM_ORDER = {chrom: i for i, chrom in enumerate(CHROMOSOMES)}
+PEAKS_PER_CHROM = 100
+
+# Size of the GTF byte ranges handed to each worker process
+GTF_CHUNK_SIZE = 16 << 20
+# File buffer size, so reads and writes go to the OS in large blocks
+BUFFER_SIZE = 1 << 20
+
+# Extra bases kept on each side of a chromosome's peak span so that
+# upstream/downstream matches near the edges are still present in the subset.
+FLANK = 50000
+
+def create_subset_bed():
+    """Keep the first PEAKS_PER_CHROM peaks of each chromosome, sorted by position.
+
+    Returns the flanked (start, end) span the selected peaks cover on each
+    chromosome, accumulated while the peaks are read.
+    """
+    print(f"Selecting {PEAKS_PER_CHROM} peaks per chromosome from {BED_INPUT}...")
+    chrom_counts = defaultdict(int)
+    chrom_ranges = {}
+    selected_peaks = []
+    filled = 0
+    with open(BED_INPUT, buffering=BUFFER_SIZE) as f_in:
+        for line in f_in:
+            fields = line.split('\t', 3)
+            if len(fields) < 3:
+                continue
+            chrom = fields[0]
+            if chrom in CHROM_ORDER and chrom_counts[chrom] < PEAKS_PER_CHROM:
+                start = int(fields[1])
+                end = int(fields[2])
+                # Decorate with the sort key now so sorting never re-parses lines
+                selected_peaks.append((CHROM_ORDER[chrom], start, line))
+                if chrom in chrom_ranges:
+                    range_start, range_end = chrom_ranges[chrom]
+                    chrom_ranges[chrom] = (min(range_start, start), max(range_end, end))
+                else:
+                    chrom_ranges[chrom] = (start, end)
+                chrom_counts[chrom] += 1
+                if chrom_counts[chrom] == PEAKS_PER_CHROM:
+                    filled += 1
+                    # Every chromosome has its quota; the rest of the file is irrelevant
+                    if filled == len(CHROMOSOMES):
+                        break
+
+    # Sort on the key only; a stable sort keeps file order for peaks sharing a start
+    selected_peaks.sort(key=operator.itemgetter(0, 1))
+
+    with open(BED_OUTPUT, 'w', buffering=BUFFER_SIZE) as f_out:
+        f_out.writelines(line for _, _, line in selected_peaks)
+
+    print(f"  -> Wrote {len(selected_peaks)} peaks to {BED_OUTPUT}")
+    for chrom in CHROMOSOMES:
+        if chrom_counts[chrom] < PEAKS_PER_CHROM:
+            print(f"  -> Warning: only {chrom_counts[chrom]} peaks found on {chrom}")
+    peak_ranges = {chrom: (max(0, start - FLANK), end + FLANK) for chrom, (start, end) in chrom_ranges.items()}
+    return peak_ranges
+
+def _line_aligned_ranges(path, chunk_size):
+    """Split a file into (start, end) byte ranges that each end just after a newline."""
+    if os.path.getsize(path) == 0:
+        return [] # mmap cannot map an empty file
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        ranges = []
+        start = 0
+        while start < size:
+            newline = mm.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _filter_gtf_range(task):
+    """Return the records of one byte range that overlap the peak ranges, and their per-chromosome counts."""
+    path, chunk_start, chunk_end, peak_ranges = task
+    kept = []
+    chrom_counts = Counter()
+    last_chrom = None
+    range_start = range_end = None
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for line in io.BytesIO(mm[chunk_start:chunk_end]):
+            if line.startswith(b'#'):
+                kept.append(line) # Keep headers
+                continue
+
+            # Only the first five columns are needed; leave the attributes unsplit
+            fields = line.split(b'\t', 5)
+            if len(fields) < 5:
+                continue
+            chrom = fields[0]
+            if chrom != last_chrom:
+                # Records are grouped by chromosome, so look the range up once per group
+                last_chrom = chrom
+                range_start, range_end = peak_ranges.get(chrom, (None, None))
+            if range_start is None:
+                continue
+
+            start = int(fields[3])
+            end = int(fields[4])
+            if end >= range_start and start <= range_end:
+                kept.append(line)
+                chrom_counts[chrom] += 1
+    return b''.join(kept), chrom_counts
+
+def create_subset_gtf(peak_ranges):
+    """Filter GTF records overlapping the peak ranges in parallel, writing them in file order."""
+    print(f"Filtering {GTF_INPUT} to the selected peak ranges...")
+    peak_ranges = {chrom.encode(): peak_range for chrom, peak_range in peak_ranges.items()}
+    tasks = [(GTF_INPUT, start, end, peak_ranges)
+             for start, end in _line_aligned_ranges(GTF_INPUT, GTF_CHUNK_SIZE)]
+    chrom_counts = Counter()
+    with multiprocessing.Pool() as pool, open(GTF_OUTPUT, 'wb', buffering=BUFFER_SIZE) as f_out:
+        # imap keeps results in submission order, so the output matches the input order
+        for blob, counts in pool.imap(_filter_gtf_range, tasks):
+            f_out.write(blob)
+            chrom_counts.update(counts)
+
+    print(f"  -> Wrote {sum(chrom_counts.values())} lines to {GTF_OUTPUT}")
+    for chrom in CHROMOSOMES:
+        count = chrom_counts[chrom.encode()]
+        if count:
+            print(f"     {chrom}: {count}")
+
+def main():
+    for path in (GTF_INPUT, BED_INPUT):
+        if not os.path.exists(path):
+            print(f"Error: Input file not found: {path}", file=sys.stderr)
+            sys.exit(1)
+    peak_ranges = create_subset_bed()
+    create_subset_gtf(peak_ranges)
+    print("Done! Subset dataset generated.")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 #!/usr/bin/env python3
+import argparse
 import os
-import gzip
+import io
+import queue
+import shutil
+import subprocess
+import threading
 import requests
 import json
 import sys
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    # ISA-L's SIMD inflate is a drop-in, several times faster zlib module
+    from isal import isal_zlib as zlib_impl
+except ImportError:
+    zlib_impl = zlib
 
 # Constants
 GENCODE_URL = "https://ftp.ebi.ac.uk/pub/databases/gencode/Gencode_human/release_49/gencode.v49.annotation.gtf.gz"
@@ -14,6 +28,19 @@ GTF_OUTPUT = os.path.join(OUTPUT_DIR, "benchmark.gtf")
 BED_OUTPUT = os.path.join(OUTPUT_DIR, "benchmark.bed")
 
 VALID_CHROMOSOMES = {"chr21", "chr22"}
+# Filtering is done on undecoded lines by matching the leading "<chrom>\t"
+VALID_PREFIXES = tuple(chrom.encode() + b'\t' for chrom in sorted(VALID_CHROMOSOMES))
+
+CHUNK_SIZE = 1 << 20
+# Decompressed line blocks buffered ahead of the filter loop
+PREFETCH_BLOCKS = 8
+# zlib window bits selecting the gzip container format
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# The resolved ENCODE file URL is remembered between runs so warm runs skip the API
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "rgmatch-rs")
+ENCODE_URL_CACHE = os.path.join(CACHE_DIR, "encode_bed_url.json")
+ENCODE_CACHE_TTL = 24 * 60 * 60
 
 def ensure_output_dir():
     """Ensure the output directory exists."""
@@ -21,32 +48,197 @@ def ensure_output_dir():
         print(f"Creating output directory: {OUTPUT_DIR}")
         os.makedirs(OUTPUT_DIR)
 
+def have_output(path):
+    """Check whether a previous run already produced a complete output file."""
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+def remove_partial(path):
+    """Delete the half-written download left behind by a failed stream."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def load_cached_bed_url():
+    """Return the BED URL resolved by a recent run, or None if missing or expired."""
+    try:
+        with open(ENCODE_URL_CACHE) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('search_url') != ENCODE_SEARCH_URL or time.time() - cached.get('time', 0) > ENCODE_CACHE_TTL:
+        return None
+    return cached.get('url')
+
+def save_cached_bed_url(url):
+    """Remember the resolved BED URL for later runs."""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(ENCODE_URL_CACHE, 'w') as f:
+            json.dump({'search_url': ENCODE_SEARCH_URL, 'url': url, 'time': time.time()}, f)
+    except OSError as e:
+        print(f"  -> Warning: could not cache BED URL: {e}", file=sys.stderr)
+
+def _pump(src, dst, errors):
+    """Copy the compressed download into the decompressor's stdin, recording any read error."""
+    try:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    except BrokenPipeError:
+        pass # Decompressor exited early; its exit status reports why
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            dst.close()
+        except BrokenPipeError:
+            pass
+
+def _inflate_blocks(raw, blocks, stop):
+    """Producer: inflate the gzip stream and queue it as blocks of whole lines, ending with an empty block."""
+    try:
+        inflater = None # None between gzip members
+        pending = b''
+        while not stop.is_set():
+            chunk = raw.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            while chunk:
+                if inflater is None:
+                    # Zero padding after a member is skipped, as gzip.open does
+                    chunk = chunk.lstrip(b'\0')
+                    if not chunk:
+                        break
+                    # Concatenated gzip members (e.g. bgzip output) each need a fresh inflater
+                    inflater = zlib_impl.decompressobj(GZIP_WBITS)
+                pending += inflater.decompress(chunk)
+                if inflater.eof:
+                    chunk = inflater.unused_data
+                    inflater = None
+                else:
+                    chunk = b''
+            cut = pending.rfind(b'\n') + 1
+            if cut:
+                # Split on '\n' only; bytes.splitlines() would also break on a lone '\r'
+                blocks.put(io.BytesIO(pending[:cut]).readlines())
+                pending = pending[cut:]
+        else:
+            return # Stopped by the consumer
+        if inflater is not None:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        if pending:
+            blocks.put([pending])
+        blocks.put([])
+    except Exception as e:
+        blocks.put(e)
+
+def _iter_blocks(blocks):
+    """Consumer: yield queued blocks, re-raising any producer error."""
+    while True:
+        block = blocks.get()
+        if isinstance(block, Exception):
+            raise block
+        if not block:
+            return
+        yield block
+
+@contextmanager
+def open_gzip_blocks(raw):
+    """Decompress a gzip byte stream into blocks of lines, via pigz when it is installed."""
+    pigz = shutil.which('pigz')
+    if pigz is None:
+        # Inflate with a bare decompressobj in a background thread (zlib releases
+        # the GIL), skipping the gzip module's buffering and readline layers, so
+        # download and decompression overlap with filtering and writing.
+        blocks = queue.Queue(maxsize=PREFETCH_BLOCKS)
+        stop = threading.Event()
+        reader = threading.Thread(target=_inflate_blocks, args=(raw, blocks, stop), daemon=True)
+        reader.start()
+        try:
+            yield _iter_blocks(blocks)
+        finally:
+            # Unblock the producer if the consumer stopped early
+            stop.set()
+            while reader.is_alive():
+                try:
+                    blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        return
+
+    # pigz decompresses in its own process while a thread feeds it the
+    # download, so network, inflate and filtering overlap across cores.
+    proc = subprocess.Popen([pigz, '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=CHUNK_SIZE)
+    feed_errors = []
+    feeder = threading.Thread(target=_pump, args=(raw, proc.stdin, feed_errors), daemon=True)
+    feeder.start()
+    try:
+        with proc.stdout as f_in:
+            yield iter(lambda: f_in.readlines(CHUNK_SIZE), [])
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        feeder.join()
+        returncode = proc.wait()
+    # A failed download also makes pigz fail; report the download error instead
+    if feed_errors:
+        raise feed_errors[0]
+    if returncode != 0:
+        raise RuntimeError(f"pigz exited with status {returncode}")
+
+def filter_blocks(blocks, prefixes, f_out, keep_headers=False):
+    """Write the lines starting with one of prefixes and return how many were kept.
+
+    With keep_headers, the '#' header lines at the top of the stream are
+    written too but not counted.
+    """
+    # Whole blocks go through a comprehension and one writelines() call, so the
+    # per-line work stays inside C builtins rather than an interpreted loop body.
+    count = 0
+    for block in blocks:
+        if keep_headers:
+            n_headers = 0
+            while n_headers < len(block) and block[n_headers].startswith(b'#'):
+                n_headers += 1
+            f_out.writelines(block[:n_headers])
+            if n_headers < len(block):
+                keep_headers = False # Past the header; the rest are records
+                block = block[n_headers:]
+            else:
+                continue
+        kept = [line for line in block if line.startswith(prefixes)]
+        f_out.writelines(kept)
+        count += len(kept)
+    return count
+
 def stream_gencode_gtf():
     """Stream and filter GENCODE GTF."""
     print(f"Streaming GENCODE GTF from {GENCODE_URL}...")
+    part = GTF_OUTPUT + '.part'
     try:
         with requests.get(GENCODE_URL, stream=True) as r:
             r.raise_for_status()
-            # Use gzip.open on the raw stream
-            with gzip.open(r.raw, mode='rt') as f_in, open(GTF_OUTPUT, 'w') as f_out:
+            raw = io.BufferedReader(r.raw, buffer_size=CHUNK_SIZE)
+            # Write to a temporary name so an interrupted download is never mistaken for a complete one
+            with open_gzip_blocks(raw) as blocks, open(part, 'wb', buffering=CHUNK_SIZE) as f_out:
                 print(f"Filtering for {VALID_CHROMOSOMES}...")
-                count = 0
-                for line in f_in:
-                    if line.startswith('#'):
-                        f_out.write(line) # Keep headers
-                        continue
-                    
-                    parts = line.split('\t')
-                    if len(parts) > 0 and parts[0] in VALID_CHROMOSOMES:
-                        f_out.write(line)
-                        count += 1
-                print(f"  -> Wrote {count} lines to {GTF_OUTPUT}")
+                count = filter_blocks(blocks, VALID_PREFIXES, f_out, keep_headers=True)
+            os.replace(part, GTF_OUTPUT)
+            print(f"  -> Wrote {count} lines to {GTF_OUTPUT}")
     except Exception as e:
         print(f"Error streaming GENCODE GTF: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        # Also runs on Ctrl-C; a no-op once the file has been renamed into place
+        remove_partial(part)
 
-def get_encode_bed_url():
+def get_encode_bed_url(use_cache=True):
     """Query ENCODE API for the first available bed narrowPeak file."""
+    cached_url = load_cached_bed_url() if use_cache else None
+    if cached_url:
+        print(f"Using cached ENCODE BED URL: {cached_url}")
+        return cached_url
+
     print(f"Querying ENCODE API...")
     try:
         # Step 1: Search for an Experiment
@@ -79,6 +271,7 @@ def get_encode_bed_url():
                 if href:
                     full_url = f"https://www.encodeproject.org{href}"
                     print(f"  -> Found BED file: {full_url}")
+                    save_cached_bed_url(full_url)
                     return full_url
         
         print("Error: No suitable BED file found in this experiment.", file=sys.stderr)
@@ -91,34 +284,48 @@ def get_encode_bed_url():
 def stream_encode_bed(url):
     """Stream and filter ENCODE BED file."""
     print(f"Streaming ENCODE BED from {url}...")
+    part = BED_OUTPUT + '.part'
     try:
         with requests.get(url, stream=True) as r:
             r.raise_for_status()
             # ENCODE bed files are usually gzipped
-            with gzip.open(r.raw, mode='rt') as f_in, open(BED_OUTPUT, 'w') as f_out:
+            raw = io.BufferedReader(r.raw, buffer_size=CHUNK_SIZE)
+            with open_gzip_blocks(raw) as blocks, open(part, 'wb', buffering=CHUNK_SIZE) as f_out:
                 print(f"Filtering for {VALID_CHROMOSOMES}...")
-                count = 0
-                for line in f_in:
-                    parts = line.split('\t')
-                    if len(parts) > 0 and parts[0] in VALID_CHROMOSOMES:
-                        f_out.write(line)
-                        count += 1
-                
+                count = filter_blocks(blocks, VALID_PREFIXES, f_out)
+
                 # Edge Case Injection
                 print("Injecting edge case 'Missing Chromosome'...")
-                f_out.write("chr99\t100\t200\tfake_region\t0\t.\t.\t.\t.\t.\n")
-                
-                print(f"  -> Wrote {count} lines + 1 edge case to {BED_OUTPUT}")
+                f_out.write(b"chr99\t100\t200\tfake_region\t0\t.\t.\t.\t.\t.\n")
+
+            os.replace(part, BED_OUTPUT)
+            print(f"  -> Wrote {count} lines + 1 edge case to {BED_OUTPUT}")
 
     except Exception as e:
          print(f"Error streaming ENCODE BED: {e}", file=sys.stderr)
          sys.exit(1)
+    finally:
+        # Also runs on Ctrl-C; a no-op once the file has been renamed into place
+        remove_partial(part)
 
 def main():
+    parser = argparse.ArgumentParser(description="Download and filter the chr21/chr22 benchmark dataset.")
+    parser.add_argument('--force', action='store_true',
+                        help="re-download everything, ignoring existing outputs and the cached ENCODE URL")
+    args = parser.parse_args()
+
     ensure_output_dir()
-    stream_gencode_gtf()
-    bed_url = get_encode_bed_url()
-    stream_encode_bed(bed_url)
+    # Outputs are renamed into place only once complete, so reuse them on warm runs.
+    # Files written by older versions of this script were not, hence the hint.
+    if not args.force and have_output(GTF_OUTPUT):
+        print(f"Using existing {GTF_OUTPUT} without checking it is complete (run with --force to re-download)")
+    else:
+        stream_gencode_gtf()
+    if not args.force and have_output(BED_OUTPUT):
+        print(f"Using existing {BED_OUTPUT} without checking it is complete (run with --force to re-download)")
+    else:
+        bed_url = get_encode_bed_url(use_cache=not args.force)
+        stream_encode_bed(bed_url)
     print("Done! Benchmark dataset generated.")
 
 if __name__ == "__main__":